@@ -1,6 +1,7 @@
 from bento_lib.config.pydantic import BentoFastAPIBaseConfig
 from fastapi import Depends
 from functools import lru_cache
+from pydantic import field_validator
 from typing import Annotated
 
 from .constants import SERVICE_GROUP, SERVICE_ARTIFACT
@@ -32,6 +33,12 @@ class Config(BentoFastAPIBaseConfig):
     #  - Default set of disabled 'insecure' algorithms (in this case symmetric key algorithms)
     disabled_token_signing_algorithms: frozenset = frozenset(["HS256", "HS384", "HS512"])
 
+    @field_validator("service_url_base_path")
+    @classmethod
+    def strip_service_url_base_path_trailing_slash(cls, v: str) -> str:
+        # Normalize once here, so URLs can be built from the base path without any further processing
+        return v.rstrip("/")
+
 
 @lru_cache()
 def get_config() -> Config:
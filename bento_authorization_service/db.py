@@ -1,6 +1,6 @@
 import asyncio
 import asyncpg
-import json
+import orjson
 
 from bento_lib.db.pg_async import PgAsyncDatabase
 from datetime import datetime
@@ -29,20 +29,20 @@ class DatabaseError(Exception):
 
 
 def subject_db_deserialize(r: asyncpg.Record | None) -> SubjectModel | None:
-    return None if r is None else SubjectModel(json.loads(r["def"]))
+    return None if r is None else SubjectModel(orjson.loads(r["def"]))
 
 
 def resource_db_deserialize(r: asyncpg.Record | None) -> ResourceModel | None:
-    return None if r is None else ResourceModel(json.loads(r["def"]))
+    return None if r is None else ResourceModel(orjson.loads(r["def"]))
 
 
-def grant_db_deserialize(r: asyncpg.Record | None) -> StoredGrantModel | None:
-    if r is None:
-        return None
+def _grant_from_record(r: asyncpg.Record, subject: SubjectModel, resource: ResourceModel) -> StoredGrantModel:
+    # Shared row -> model mapping for grant_db_deserialize(...) and grants_db_deserialize(...), given the already-parsed
+    # subject and resource definitions.
     return StoredGrantModel(
         id=r["id"],
-        subject=SubjectModel(json.loads(r["subject"])),
-        resource=ResourceModel(json.loads(r["resource"])),
+        subject=subject,
+        resource=resource,
         notes=r["notes"],
         created=r["created"],
         expiry=r["expiry"],
@@ -51,6 +51,20 @@ def grant_db_deserialize(r: asyncpg.Record | None) -> StoredGrantModel | None:
     )
 
 
+def grant_db_deserialize(r: asyncpg.Record | None) -> StoredGrantModel | None:
+    if r is None:
+        return None
+    return _grant_from_record(r, SubjectModel(orjson.loads(r["subject"])), ResourceModel(orjson.loads(r["resource"])))
+
+
+def grants_db_deserialize(rs: list[asyncpg.Record]) -> tuple[StoredGrantModel, ...]:
+    # Column-oriented version of grant_db_deserialize(...) for bulk fetches: parse all the subject JSON, then all the
+    # resource JSON, then build the models, rather than interleaving parsing and validation row-by-row.
+    subjects = [SubjectModel(orjson.loads(r["subject"])) for r in rs]
+    resources = [ResourceModel(orjson.loads(r["resource"])) for r in rs]
+    return tuple(map(_grant_from_record, rs, subjects, resources))
+
+
 def group_db_serialize(g: GroupModel) -> tuple[str, str, str, datetime]:
     return (
         g.name,
@@ -66,7 +80,7 @@ def group_db_deserialize(r: asyncpg.Record | None) -> StoredGroupModel | None:
     return StoredGroupModel(
         id=r["id"],
         name=r["name"],
-        membership=json.loads(r["membership"]),
+        membership=orjson.loads(r["membership"]),
         notes=r["notes"],
         created=r["created"],
         expiry=r["expiry"],
@@ -76,6 +90,8 @@ def group_db_deserialize(r: asyncpg.Record | None) -> StoredGroupModel | None:
 class Database(PgAsyncDatabase):
     def __init__(self, db_uri: str):
         super().__init__(db_uri, SCHEMA_PATH)
+        # (policy version, grants, groups dict) - see get_grants_and_groups_dict(...)
+        self._policy_snapshot: tuple[int, tuple[StoredGrantModel, ...], dict[int, StoredGroupModel]] | None = None
 
     async def get_subject(self, id_: int) -> SubjectModel | None:
         conn: asyncpg.Connection
@@ -88,7 +104,9 @@ class Database(PgAsyncDatabase):
         s: SubjectModel,
         existing_conn: asyncpg.Connection | None = None,
     ) -> int | None:
-        s_ser: str = json_model_dump_kwargs(s, sort_keys=True)
+        # JSONB equality ignores key order, so there's no need to canonicalize via a sorted stdlib dump here - Pydantic's
+        # schema-specialized (Rust) serializer emits the same fields, in declaration order, much more cheaply.
+        s_ser: str = s.model_dump_json()
         conn: asyncpg.Connection
         async with self.connect(existing_conn) as conn:
             if (id_ := await conn.fetchval("SELECT id FROM subjects WHERE def = $1::jsonb", s_ser)) is not None:
@@ -107,7 +125,7 @@ class Database(PgAsyncDatabase):
         r: ResourceModel,
         existing_conn: asyncpg.Connection | None = None,
     ) -> int | None:
-        r_ser: str = json_model_dump_kwargs(r, sort_keys=True)
+        r_ser: str = r.model_dump_json()  # See note in create_subject_or_get_id(...) re: not sorting keys
         conn: asyncpg.Connection
         async with self.connect(existing_conn) as conn:
             if (id_ := await conn.fetchval("SELECT id FROM resources WHERE def = $1::jsonb", r_ser)) is not None:
@@ -118,24 +136,26 @@ class Database(PgAsyncDatabase):
     async def get_grant(self, id_: int) -> StoredGrantModel | None:
         conn: asyncpg.Connection
         async with self.connect() as conn:
+            # For a single grant, a scalar sub-select for the permissions lets Postgres use the grant_permissions primary
+            # key index directly, rather than joining + grouping the outer query.
             row: asyncpg.Record | None = await conn.fetchrow(
                 """
-                SELECT 
-                    j."id" AS id, 
-                    s."def" AS subject, 
+                SELECT
+                    g."id" AS id,
+                    s."def" AS subject,
                     r."def" AS resource,
-                    j."notes" AS notes,
-                    j."created" AS created,
-                    j."expiry" AS expiry,
-                    j."permissions" AS permissions
-                FROM (
-                    SELECT g.*, array_agg(gp."permission") AS permissions
-                    FROM grants g LEFT JOIN grant_permissions gp ON g."id" = gp."grant"
-                    WHERE g."id" = $1
-                    GROUP BY g."id"
-                ) j 
-                JOIN subjects s ON j."subject" = s."id" 
-                JOIN resources r ON j."resource" = r."id"
+                    g."notes" AS notes,
+                    g."created" AS created,
+                    g."expiry" AS expiry,
+                    (
+                        SELECT coalesce(array_agg(gp."permission"), '{}')
+                        FROM grant_permissions gp
+                        WHERE gp."grant" = g."id"
+                    ) AS permissions
+                FROM grants g
+                JOIN subjects s ON g."subject" = s."id"
+                JOIN resources r ON g."resource" = r."id"
+                WHERE g."id" = $1
                 """,
                 id_,
             )
@@ -163,7 +183,7 @@ class Database(PgAsyncDatabase):
                 JOIN resources r ON j."resource" = r."id"
                 """
             )
-            return tuple(grant_db_deserialize(r) for r in res)
+            return grants_db_deserialize(res)
 
     async def create_grant(self, grant: GrantModel) -> int | None:
         conn: asyncpg.Connection
@@ -235,8 +255,23 @@ class Database(PgAsyncDatabase):
     async def get_groups_dict(self) -> dict[int, StoredGroupModel]:
         return {g.id: g for g in (await self.get_groups())}
 
+    async def get_policy_version(self) -> int:
+        conn: asyncpg.Connection
+        async with self.connect() as conn:
+            return await conn.fetchval('SELECT "version" FROM policy_version')
+
     async def get_grants_and_groups_dict(self) -> tuple[tuple[StoredGrantModel, ...], dict[int, StoredGroupModel]]:
-        return await asyncio.gather(self.get_grants(), self.get_groups_dict())
+        # Grants and groups change far less often than policy is evaluated, so keep a snapshot of both alongside the
+        # policy version (bumped by triggers on any grant/group change, including from other service instances or the
+        # CLI.) If the version hasn't changed, a single cheap query replaces fetching + deserializing everything.
+        # The version is read BEFORE fetching, so a change made mid-fetch just results in a re-fetch next time.
+        version = await self.get_policy_version()
+        if (snapshot := self._policy_snapshot) is not None and snapshot[0] == version:
+            return snapshot[1], snapshot[2]
+
+        grants, groups_dict = await asyncio.gather(self.get_grants(), self.get_groups_dict())
+        self._policy_snapshot = (version, grants, groups_dict)
+        return grants, groups_dict
 
     async def create_group(self, group: GroupModel) -> int | None:
         # GROUP_SCHEMA_VALIDATOR.validate(group)  # Will raise if the group is invalid
@@ -260,10 +295,14 @@ class Database(PgAsyncDatabase):
     async def delete_group_and_dependent_grants(self, group_id: int) -> None:
         conn: asyncpg.Connection
         async with self.connect() as conn:
-            async with conn.transaction():  # Use a single transaction to make all deletes occur at the same time
-                # The Postgres JSON access returns NULL if the field doesn't exist, so the below works.
-                await conn.execute("DELETE FROM subjects WHERE (def->>'group')::int = $1", group_id)
-                await conn.execute("DELETE FROM groups WHERE id = $1", group_id)
+            # Use a single statement (with a data-modifying CTE) to make all deletes occur atomically in one round trip.
+            # The Postgres JSON access returns NULL if the field doesn't exist, so the below works. Deleting subjects
+            # cascades to any grants which reference them.
+            await conn.execute(
+                "WITH del_subjects AS (DELETE FROM subjects WHERE (def->>'group')::int = $1 RETURNING 1) "
+                "DELETE FROM groups WHERE id = $1",
+                group_id,
+            )
 
 
 @lru_cache()
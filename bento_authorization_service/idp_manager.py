@@ -1,13 +1,18 @@
 import aiohttp
+import asyncio
 import jwt
+import orjson
+import sys
+import time
 
 from abc import ABC, abstractmethod
-from datetime import datetime
+from collections import OrderedDict
+from contextvars import ContextVar
 from fastapi import Depends
-from functools import lru_cache
-from typing import Annotated, Optional
+from jwt.utils import base64url_decode
+from typing import Annotated, Any, Optional
 
-from .config import ConfigDependency
+from .config import Config, ConfigDependency
 from .logger import logger
 
 __all__ = [
@@ -17,6 +22,7 @@ __all__ = [
     "IdPManager",
     "get_idp_manager",
     "IdPManagerDependency",
+    "get_unverified_header",
 ]
 
 
@@ -32,7 +38,47 @@ class IdPManagerBadAlgorithmError(IdPManagerError):
     pass
 
 
+def get_unverified_header(token: str) -> dict:
+    """
+    Equivalent to jwt.get_unverified_header(...), but only decodes the header segment and parses it with orjson.
+    Like the PyJWT version, this raises jwt.DecodeError if the token doesn't have the three (header, payload, signature)
+    segments or if the header cannot be decoded, and checks that the key ID (if present) is a string, since it's used as
+    a dictionary key for looking up the signing key.
+    :param token: An encoded JWT.
+    :return: The token's (unverified!) header dictionary.
+    """
+
+    if not isinstance(token, str) or token.count(".") != 2:
+        raise jwt.DecodeError("Invalid token: must have header, payload, and signature segments")
+
+    try:
+        header = orjson.loads(base64url_decode(token.split(".", 1)[0]))
+    except (TypeError, ValueError) as e:  # Includes bad base64 padding, bad UTF-8, and bad JSON
+        raise jwt.DecodeError(f"Invalid header: {e}") from e
+
+    if not isinstance(header, dict):
+        raise jwt.DecodeError("Invalid header string: must be a json object")
+
+    if "kid" in header and not isinstance(header["kid"], str):
+        raise jwt.DecodeError("Key ID header parameter must be a string")
+
+    return header
+
+
+INTERNED_TOKEN_CLAIMS = ("iss", "azp", "sub")  # Claims compared against grant subjects & group members
+
+
 class BaseIdPManager(ABC):
+    # Slotted, since manager attributes are read on every token decode
+    __slots__ = (
+        "_openid_config_url",
+        "_audience",
+        "_disabled_token_signing_algorithms",
+        "_debug",
+        "_permitted_token_signing_algs",
+        "_initialized",
+    )
+
     def __init__(
         self,
         openid_config_url: str,
@@ -45,6 +91,10 @@ class BaseIdPManager(ABC):
         self._disabled_token_signing_algorithms: frozenset[str] = disabled_token_signing_algorithms
         self._debug: bool = debug
 
+        # Memoized result of get_permitted_token_signing_algs(); subclasses must reset this to None whenever the set of
+        # supported token signing algorithms may have changed.
+        self._permitted_token_signing_algs: frozenset[str] | None = None
+
         self._initialized: bool = False
 
     @property
@@ -60,31 +110,38 @@ class BaseIdPManager(ABC):
         pass
 
     def get_permitted_token_signing_algs(self) -> frozenset[str]:
-        # Assume we have the same set of signing algorithms for access tokens as ID tokens
-        return self.get_supported_token_signing_algs() - self._disabled_token_signing_algorithms
+        if (permitted_algs := self._permitted_token_signing_algs) is None:
+            # Assume we have the same set of signing algorithms for access tokens as ID tokens
+            permitted_algs = self.get_supported_token_signing_algs() - self._disabled_token_signing_algorithms
+            self._permitted_token_signing_algs = permitted_algs
+        return permitted_algs
 
     def _verify_token_and_decode(
         self,
         token: str,
-        signing_key: jwt.PyJWK | str,
+        signing_key: Any,  # Raw key material: a shared secret string, or a cryptography public key object
     ) -> dict:
-        permitted_algs = self.get_permitted_token_signing_algs()
-
-        # Check the token matches permitted algorithms
-        self.check_token_signing_alg(jwt.get_unverified_header(token), permitted_algs)
+        if not (permitted_algs := self.get_permitted_token_signing_algs()):
+            raise IdPManagerBadAlgorithmError("No token signing algorithms permitted")
 
-        # Return the decoded & verified JWT
-        return jwt.decode(
-            token,
-            signing_key if isinstance(signing_key, str) else signing_key.key,
-            audience=self.audience,
-            algorithms=permitted_algs,
-        )
-
-    @staticmethod
-    def check_token_signing_alg(token_header: dict, permitted_algs: frozenset[str]):
-        if (alg := token_header.get("alg")) is None or alg not in permitted_algs:
-            raise IdPManagerBadAlgorithmError("Token signing algorithm not permitted")
+        # Return the decoded & verified JWT. PyJWT checks the token's signing algorithm against the permitted ones
+        # itself (from the header it has to parse anyway), so we don't need to parse & check it separately beforehand.
+        try:
+            payload = jwt.decode(
+                token,
+                signing_key,
+                audience=self.audience,
+                algorithms=permitted_algs,
+            )
+        except jwt.InvalidAlgorithmError as e:
+            raise IdPManagerBadAlgorithmError("Token signing algorithm not permitted") from e
+
+        # Intern the identity claims which get compared against (also interned) grant subject/group member IDs
+        for claim in INTERNED_TOKEN_CLAIMS:
+            if isinstance(v := payload.get(claim), str):
+                payload[claim] = sys.intern(v)
+
+        return payload
 
     @abstractmethod
     async def initialize(self):  # pragma: no cover
@@ -98,12 +155,41 @@ class BaseIdPManager(ABC):
     async def decode(self, token: str) -> dict:  # pragma: no cover
         pass
 
+    async def close(self) -> None:
+        # Release any resources (e.g., HTTP sessions) held by the manager; by default, there are none.
+        pass
+
 
 JWKS_EXPIRY_TIME = 60  # seconds
+# After JWKS_EXPIRY_TIME, cached keys are still used (while being refreshed in the background) until they are this old:
+JWKS_STALE_TIME = 600  # seconds
 OPENID_CONFIGURATION_EXPIRY_TIME = 3600  # seconds
 
+DECODED_TOKEN_CACHE_SIZE = 1024  # tokens
+DECODED_TOKEN_CACHE_MAX_TTL = 60  # seconds - entries will also never outlive the token's own expiry time
+
+# Most recently decoded (IdP manager, token, payload, entry expiry) in the current context. Each request is handled in
+# its own context, so this lets repeated decodes of the same token within a request (e.g., from multiple dependencies)
+# skip even the LRU cache. The entry is tied to the IdP manager which verified the token (since audience etc. can differ
+# between managers), and has the same expiry as the corresponding LRU cache entry.
+_request_decoded_token: ContextVar[tuple[BaseIdPManager, str, dict, float] | None] = ContextVar(
+    "request_decoded_token", default=None
+)
+
 
 class IdPManager(BaseIdPManager):
+    __slots__ = (
+        "_openid_config_data",
+        "_openid_config_data_last_fetched",
+        "_signing_keys_by_kid",
+        "_jwks_last_fetched",
+        "_openid_config_fetch_lock",
+        "_jwks_fetch_lock",
+        "_jwks_refresh_task",
+        "_session",
+        "_decoded_token_cache",
+    )
+
     def __init__(
         self,
         openid_config_url: str,
@@ -114,18 +200,71 @@ class IdPManager(BaseIdPManager):
         super().__init__(openid_config_url, audience, disabled_token_signing_algorithms, debug)
 
         self._openid_config_data: Optional[dict] = None
-        self._openid_config_data_last_fetched: Optional[datetime] = None
-
-        self._jwks: tuple[jwt.PyJWK, ...] = ()
-        self._jwks_last_fetched = 0
+        self._openid_config_data_last_fetched: Optional[float] = None  # time.monotonic() value
+
+        # Signing keys from the IdP's JWKS, keyed by key ID. We store the materialized (cryptography) key objects
+        # rather than the PyJWK instances, so they can be handed straight to jwt.decode(...).
+        self._signing_keys_by_kid: dict[str, Any] = {}
+        self._jwks_last_fetched: Optional[float] = None  # time.monotonic() value
+
+        # Locks to make sure only one coroutine at a time re-fetches OpenID configuration / JWKS data from the IdP; any
+        # others which were waiting on a lock will find fresh data once they acquire it, and skip their own fetch.
+        self._openid_config_fetch_lock = asyncio.Lock()
+        self._jwks_fetch_lock = asyncio.Lock()
+        self._jwks_refresh_task: Optional[asyncio.Task] = None  # Background (stale-while-revalidate) JWKS refresh
+
+        self._session: Optional[aiohttp.ClientSession] = None
+
+        # LRU cache of raw token string -> (verified token payload, cache entry expiry as a UNIX timestamp)
+        self._decoded_token_cache: OrderedDict[str, tuple[dict, float]] = OrderedDict()
+
+    def _get_session(self) -> aiohttp.ClientSession:
+        # Keep a single session around, tuned for talking to one host with small, periodic requests, so that JWKS
+        # refreshes can re-use a warm keep-alive connection instead of doing a fresh TCP + TLS handshake each time.
+        if self._session is None or self._session.closed:
+            self._session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(
+                    verify_ssl=not self.debug,
+                    limit=10,
+                    limit_per_host=2,
+                    ttl_dns_cache=300,
+                    keepalive_timeout=600,
+                    enable_cleanup_closed=True,
+                ),
+                timeout=aiohttp.ClientTimeout(total=5),
+            )
+        return self._session
+
+    async def close(self) -> None:
+        if self._jwks_refresh_task is not None and not self._jwks_refresh_task.done():
+            self._jwks_refresh_task.cancel()
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+    def _openid_config_expired(self) -> bool:
+        lf = self._openid_config_data_last_fetched
+        return lf is None or time.monotonic() - lf > OPENID_CONFIGURATION_EXPIRY_TIME
 
     async def fetch_openid_config_if_needed(self):
-        lf = self._openid_config_data_last_fetched
-        if not lf or (datetime.now() - lf).seconds > OPENID_CONFIGURATION_EXPIRY_TIME:
-            async with aiohttp.ClientSession(connector=aiohttp.TCPConnector(verify_ssl=not self.debug)) as session:
-                async with session.get(self._openid_config_url) as res:
-                    self._openid_config_data = await res.json()
-                    self._openid_config_data_last_fetched = datetime.now()
+        if not self._openid_config_expired():
+            return
+
+        async with self._openid_config_fetch_lock:
+            if not self._openid_config_expired():  # Another coroutine fetched the configuration while we were waiting
+                return
+
+            async with self._get_session().get(self._openid_config_url) as res:
+                self._openid_config_data = await res.json(loads=orjson.loads)
+                self._openid_config_data_last_fetched = time.monotonic()
+                self._permitted_token_signing_algs = None  # Supported algorithms may have changed; re-compute lazily
+
+    def _jwks_age(self) -> float:
+        # Monotonic clock: cheaper than building a datetime, and immune to wall-clock adjustments (e.g., NTP syncs).
+        return float("inf") if (lf := self._jwks_last_fetched) is None else time.monotonic() - lf
+
+    def _jwks_expired(self) -> bool:
+        return self._jwks_age() > JWKS_EXPIRY_TIME
 
     async def fetch_jwks_if_needed(self):
         await self.fetch_openid_config_if_needed()
@@ -134,24 +273,52 @@ class IdPManager(BaseIdPManager):
             logger.error("fetch_jwks: Missing OpenID configuration data")
             return
 
-        if ((now := datetime.now().timestamp()) - self._jwks_last_fetched) > JWKS_EXPIRY_TIME:
+        if not self._jwks_expired():
+            return
+
+        async with self._jwks_fetch_lock:
+            if not self._jwks_expired():  # Another coroutine fetched the key set while we were waiting
+                return
+
+            now = time.monotonic()
+
             # Manually do JWK signing key fetching. This way, we can turn off SSL verification in debug mode.
-            async with aiohttp.ClientSession(connector=aiohttp.TCPConnector(verify_ssl=not self.debug)) as session:
-                async with session.get(self._openid_config_data["jwks_uri"]) as res:
-                    self._jwks = tuple(
-                        k
-                        for k in jwt.PyJWKSet.from_dict(await res.json()).keys
-                        if k.public_key_use in ("sig", None) and k.key_id
-                    )
-                    self._jwks_last_fetched = now
-
-    def get_signing_key_from_jwt(self, token: str) -> jwt.PyJWK | None:
-        header = jwt.get_unverified_header(token)
-        return next((k for k in self._jwks if k.key_id == header["kid"]), None)
+            async with self._get_session().get(self._openid_config_data["jwks_uri"]) as res:
+                jwks_data = await res.json(loads=orjson.loads)
+
+            # Don't bother materializing keys which are explicitly bound to a signing algorithm we don't permit, since
+            # any token signed with them will be rejected anyway.
+            key_algs = (None, *self.get_permitted_token_signing_algs())
+            jwks_data["keys"] = [k for k in jwks_data.get("keys", ()) if k.get("alg", None) in key_algs]
+
+            self._signing_keys_by_kid = (
+                {
+                    k.key_id: k.key
+                    for k in jwt.PyJWKSet.from_dict(jwks_data).keys
+                    if k.public_key_use in ("sig", None) and k.key_id
+                }
+                if jwks_data["keys"]
+                else {}
+            )
+            self._jwks_last_fetched = now
+
+    async def _refresh_jwks_in_background(self):
+        try:
+            await self.fetch_jwks_if_needed()
+        except Exception as e:
+            logger.error(f"Background JWKS refresh failed: encountered exception '{repr(e)}'")
+
+    def _schedule_jwks_refresh(self):
+        if self._jwks_refresh_task is None or self._jwks_refresh_task.done():
+            self._jwks_refresh_task = asyncio.create_task(self._refresh_jwks_in_background())
+
+    def get_signing_key_for_kid(self, kid: str | None) -> Any | None:
+        return self._signing_keys_by_kid.get(kid)
 
     async def initialize(self):
         try:
-            await self.fetch_openid_config_if_needed()
+            # fetch_jwks_if_needed() fetches the OpenID configuration first (since that's where the JWKS URI comes from),
+            # so there's no need to separately fetch and then re-check it here.
             await self.fetch_jwks_if_needed()
             self._initialized = True
         except Exception as e:
@@ -161,8 +328,48 @@ class IdPManager(BaseIdPManager):
     def get_supported_token_signing_algs(self) -> frozenset[str]:
         return frozenset(self._openid_config_data["id_token_signing_alg_values_supported"])
 
+    def _get_cached_decoded_token_entry(self, token: str) -> tuple[dict, float] | None:
+        cache = self._decoded_token_cache
+
+        if (entry := cache.get(token)) is None:
+            return None
+
+        if entry[1] <= time.time():
+            del cache[token]
+            return None
+
+        cache.move_to_end(token)
+        return entry
+
+    def _get_cached_decoded_token(self, token: str) -> dict | None:
+        return None if (entry := self._get_cached_decoded_token_entry(token)) is None else entry[0]
+
+    def _cache_decoded_token(self, token: str, payload: dict) -> float:
+        entry_expiry = time.time() + DECODED_TOKEN_CACHE_MAX_TTL
+        if isinstance(token_exp := payload.get("exp"), (int, float)):
+            entry_expiry = min(entry_expiry, token_exp)
+
+        cache = self._decoded_token_cache
+        cache[token] = (payload, entry_expiry)
+        cache.move_to_end(token)
+        if len(cache) > DECODED_TOKEN_CACHE_SIZE:
+            cache.popitem(last=False)  # Evict least-recently-used token
+
+        return entry_expiry
+
     async def decode(self, token: str) -> dict:
-        await self.fetch_jwks_if_needed()  # Refresh well-known key set if it has expired or not yet been fetched
+        # Signature verification is expensive, and the same token is typically presented many times in a short window,
+        # so keep recently-verified payloads around for a short time (bounded by the token's expiry).
+        if (
+            (rdt := _request_decoded_token.get()) is not None
+            and rdt[0] is self
+            and rdt[1] == token
+            and rdt[3] > time.time()
+        ):
+            return rdt[2]
+        if (entry := self._get_cached_decoded_token_entry(token)) is not None:
+            _request_decoded_token.set((self, token, *entry))
+            return entry[0]
 
         # This relies on access tokens following RFC9068, rather than using the introspection endpoint.
 
@@ -171,24 +378,54 @@ class IdPManager(BaseIdPManager):
             if not self._initialized:  # Initialization failed
                 raise UninitializedIdPManagerError("IdpManager initialization failed")
 
-        if not self._jwks_last_fetched:
+        if (jwks_last_fetched := self._jwks_last_fetched) is None:
             raise UninitializedIdPManagerError("JWKS not fetched")
 
-        if (sk := self.get_signing_key_from_jwt(token)) is not None:
-            # Obtain the IdP's supported token signing algorithms & pass them to the verify function
-            return self._verify_token_and_decode(token, sk)
+        kid = get_unverified_header(token).get("kid")
+        sk = self.get_signing_key_for_kid(kid)
+
+        # Inlined TTL check, so the common case (fresh key set) doesn't need any extra method calls or awaits
+        if (jwks_age := time.monotonic() - jwks_last_fetched) > JWKS_EXPIRY_TIME:
+            if sk is not None and jwks_age <= JWKS_STALE_TIME:
+                # Stale-while-revalidate: the key set is past its expiry but still usable, so verify with the cached key
+                # and refresh the key set in the background, rather than putting an IdP round trip in the request path.
+                self._schedule_jwks_refresh()
+            else:
+                # Key set is too old to trust, or doesn't have this token's key (which may have been rotated in) - block
+                # on a refresh.
+                await self.fetch_jwks_if_needed()
+                sk = self.get_signing_key_for_kid(kid)
+
+        if sk is not None:
+            # Obtain the IdP's supported token signing algorithms & pass them to the verify function.
+            # Signature verification is synchronous, CPU-bound work (which releases the GIL inside OpenSSL), so run it in
+            # a worker thread rather than blocking the event loop for other in-flight requests.
+            payload = await asyncio.to_thread(self._verify_token_and_decode, token, sk)
+            entry_expiry = self._cache_decoded_token(token, payload)
+            _request_decoded_token.set((self, token, payload, entry_expiry))
+            return payload
 
         raise IdPManagerError("Could not get signing key for token")
 
 
-@lru_cache()
+# IdP manager instances, keyed by the identity of the config object they were created from. In practice, there is only
+# one config object (get_config() is cached) - keying by identity avoids lru_cache hashing the whole (frozen) config
+# model on every request. The config is kept in the value too, so its id(...) cannot be re-used while we hold onto it.
+_idp_managers: dict[int, tuple[Config, BaseIdPManager]] = {}
+
+
 def get_idp_manager(config: ConfigDependency) -> BaseIdPManager:
-    return IdPManager(
+    if (entry := _idp_managers.get(id(config))) is not None:
+        return entry[1]
+
+    idp_manager = IdPManager(
         config.openid_config_url,
         config.token_audience,
         config.disabled_token_signing_algorithms,
         config.bento_debug,
     )
+    _idp_managers[id(config)] = (config, idp_manager)
+    return idp_manager
 
 
 IdPManagerDependency = Annotated[BaseIdPManager, Depends(get_idp_manager)]
@@ -7,8 +7,11 @@ __all__ = [
 ]
 
 
+_SCHEMA_BASE_URL = f"{get_config().service_url_base_path}/schemas"  # Trailing slash stripped by Config
+
+
 def _make_schema_id(name: str) -> str:
-    return f"{get_config().service_url_base_path.rstrip('/')}/schemas/{name}.json"
+    return f"{_SCHEMA_BASE_URL}/{name}.json"
 
 
 TOKEN_DATA = {
@@ -7,9 +7,13 @@ __all__ = [
     "logger",
 ]
 
-logging.basicConfig(level=logging.DEBUG)
+_log_level = log_level_from_str(get_config().log_level)
+
+# Configure the root logger with the service's log level too, rather than DEBUG; otherwise, DEBUG records from
+# libraries (which propagate up to the root handler) get created and emitted regardless of the configured level.
+logging.basicConfig(level=_log_level)
 
 # TODO: convert to injectable thing for FastAPI
 
 logger = logging.getLogger(__name__)
-logger.setLevel(log_level_from_str(get_config().log_level))
+logger.setLevel(_log_level)
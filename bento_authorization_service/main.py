@@ -1,10 +1,14 @@
 from bento_lib.apps.fastapi import BentoFastAPI
 from bento_lib.service_info.types import BentoExtraServiceInfo
+from contextlib import asynccontextmanager
+from fastapi import FastAPI
+from fastapi.responses import ORJSONResponse
 
 from . import __version__
 from .authz import authz_middleware
 from .config import get_config
 from .constants import BENTO_SERVICE_KIND, SERVICE_TYPE
+from .idp_manager import get_idp_manager
 from .logger import logger
 from .routers.all_permissions import all_permissions_router
 from .routers.grants import grants_router
@@ -23,10 +27,21 @@ BENTO_SERVICE_INFO: BentoExtraServiceInfo = {
 # TODO: Find a way to DI this
 config_for_setup = get_config()
 
-app = BentoFastAPI(authz_middleware, config_for_setup, logger, BENTO_SERVICE_INFO, SERVICE_TYPE, __version__)
 
-app.include_router(all_permissions_router)
-app.include_router(grants_router)
-app.include_router(groups_router)
-app.include_router(policy_router)
-app.include_router(schema_router)
+@asynccontextmanager
+async def lifespan(_app: FastAPI):
+    yield
+    # Release the IdP manager's persistent HTTP session on shutdown
+    await get_idp_manager(config_for_setup).close()
+
+
+app = BentoFastAPI(
+    authz_middleware, config_for_setup, logger, BENTO_SERVICE_INFO, SERVICE_TYPE, __version__, lifespan=lifespan
+)
+
+# Serialize our own routes' responses with orjson rather than the standard library JSON encoder
+app.include_router(all_permissions_router, default_response_class=ORJSONResponse)
+app.include_router(grants_router, default_response_class=ORJSONResponse)
+app.include_router(groups_router, default_response_class=ORJSONResponse)
+app.include_router(policy_router, default_response_class=ORJSONResponse)
+app.include_router(schema_router, default_response_class=ORJSONResponse)
@@ -1,6 +1,21 @@
+import math
+import sys
+
+from bento_lib.search.queries import AST, convert_query_to_ast_and_preprocess
 from datetime import datetime
-from pydantic import BaseModel, Field, ConfigDict, RootModel, field_serializer
-from typing import Literal
+from pydantic import (
+    AfterValidator,
+    BaseModel,
+    Discriminator,
+    Field,
+    ConfigDict,
+    PrivateAttr,
+    RootModel,
+    Tag,
+    field_serializer,
+    model_validator,
+)
+from typing import Annotated, Any, Literal
 
 __all__ = [
     # Subject:
@@ -29,26 +44,50 @@ __all__ = [
 ]
 
 
+def _field_presence_discriminator(*fields: str) -> Discriminator:
+    # Tags each union member by a field only it has, so pydantic can go straight to the right member rather than trying
+    # to validate the value against every member in turn. Works for both raw dicts and already-constructed models.
+    def _discriminate(v: Any) -> str | None:
+        if isinstance(v, dict):
+            return next((f for f in fields if f in v), None)
+        return next((f for f in fields if hasattr(v, f)), None)
+
+    return Discriminator(_discriminate)
+
+
 class BaseImmutableModel(BaseModel):
     # Immutable hashable record
     model_config = ConfigDict(frozen=True)
 
+    def model_copy(self, *, update: dict[str, Any] | None = None, deep: bool = False):
+        # Derived private attributes are computed from field values in model_post_init(...); model_copy(...) copies them
+        # as-is without re-running it, so re-derive them when fields are being updated to keep them from going stale.
+        copied = super().model_copy(update=update, deep=deep)
+        if update:
+            copied.model_post_init(None)
+        return copied
+
 
 class BaseImmutableRootModel(RootModel):
     # Immutable hashable record
     model_config = ConfigDict(frozen=True)
 
 
+# Issuer/client/subject IDs come from a small set of values and are compared against token claims (which are interned
+# too; see BaseIdPManager) during policy evaluation, so intern them to make equality checks mostly identity checks.
+_InternedStr = Annotated[str, AfterValidator(sys.intern)]
+
+
 class BaseIssuerModel(BaseImmutableModel):
-    iss: str
+    iss: _InternedStr
 
 
 class IssuerAndClientModel(BaseIssuerModel):
-    client: str
+    client: _InternedStr
 
 
 class IssuerAndSubjectModel(BaseIssuerModel):
-    sub: str
+    sub: _InternedStr
 
 
 class SubjectEveryoneModel(BaseImmutableModel):
@@ -60,7 +99,22 @@ class SubjectGroupModel(BaseImmutableModel):
 
 
 class SubjectModel(BaseImmutableRootModel):
-    root: SubjectEveryoneModel | SubjectGroupModel | IssuerAndClientModel | IssuerAndSubjectModel
+    root: Annotated[
+        Annotated[SubjectEveryoneModel, Tag("everyone")]
+        | Annotated[SubjectGroupModel, Tag("group")]
+        | Annotated[IssuerAndClientModel, Tag("client")]
+        | Annotated[IssuerAndSubjectModel, Tag("sub")],
+        _field_presence_discriminator("everyone", "group", "client", "sub"),
+    ]
+
+    @model_validator(mode="before")
+    @classmethod
+    def intern_everyone(cls, v: Any) -> Any:
+        # {"everyone": true} is the most common subject; re-use the shared immutable instance rather than validating and
+        # constructing a new one each time.
+        if isinstance(v, dict) and len(v) == 1 and v.get("everyone") is True:
+            return SUBJECT_EVERYONE.root
+        return v
 
 
 SUBJECT_EVERYONE = SubjectModel.model_validate(SubjectEveryoneModel(everyone=True))
@@ -69,16 +123,54 @@ SUBJECT_EVERYONE = SubjectModel.model_validate(SubjectEveryoneModel(everyone=Tru
 class GroupMembershipExpr(BaseImmutableModel):
     expr: list  # JSON representation of query format
 
+    # Compiled & pre-processed form of the membership expression, built once at validation time so it isn't re-parsed
+    # for every membership check.
+    _ast: AST = PrivateAttr()
+
+    def model_post_init(self, _context: Any) -> None:
+        self._ast = convert_query_to_ast_and_preprocess(self.expr)
+
+    @property
+    def ast(self) -> AST:
+        return self._ast
+
 
 class GroupMembershipItemModel(BaseImmutableRootModel):
-    root: IssuerAndClientModel | IssuerAndSubjectModel
+    root: Annotated[
+        Annotated[IssuerAndClientModel, Tag("client")] | Annotated[IssuerAndSubjectModel, Tag("sub")],
+        _field_presence_discriminator("client", "sub"),
+    ]
 
 
 class GroupMembershipMembers(BaseImmutableModel):
     members: list[GroupMembershipItemModel]
 
+    # Sets of (issuer, client ID) and (issuer, subject ID) pairs for the members of this group, built at validation
+    # time, so checking membership for a token is a couple of set lookups rather than a scan over every member.
+    _iss_client_pairs: frozenset[tuple[str, str]] = PrivateAttr()
+    _iss_sub_pairs: frozenset[tuple[str, str]] = PrivateAttr()
+
+    def model_post_init(self, _context: Any) -> None:
+        self._iss_client_pairs = frozenset(
+            (m.iss, m.client) for mm in self.members if isinstance(m := mm.root, IssuerAndClientModel)
+        )
+        self._iss_sub_pairs = frozenset(
+            (m.iss, m.sub) for mm in self.members if isinstance(m := mm.root, IssuerAndSubjectModel)
+        )
 
-GroupMembership = GroupMembershipExpr | GroupMembershipMembers
+    @property
+    def iss_client_pairs(self) -> frozenset[tuple[str, str]]:
+        return self._iss_client_pairs
+
+    @property
+    def iss_sub_pairs(self) -> frozenset[tuple[str, str]]:
+        return self._iss_sub_pairs
+
+
+GroupMembership = Annotated[
+    Annotated[GroupMembershipExpr, Tag("expr")] | Annotated[GroupMembershipMembers, Tag("members")],
+    _field_presence_discriminator("expr", "members"),
+]
 
 
 class GroupModel(BaseImmutableModel):
@@ -87,6 +179,16 @@ class GroupModel(BaseImmutableModel):
     expiry: datetime | None
     notes: str = ""
 
+    # Expiry as a POSIX timestamp (infinity if the group never expires); see GrantModel
+    _expiry_timestamp: float = PrivateAttr()
+
+    def model_post_init(self, _context: Any) -> None:
+        self._expiry_timestamp = math.inf if self.expiry is None else self.expiry.timestamp()
+
+    @property
+    def expiry_timestamp(self) -> float:
+        return self._expiry_timestamp
+
 
 class StoredGroupModel(GroupModel):
     id: int
@@ -104,7 +206,18 @@ class ResourceSpecificModel(BaseImmutableModel):
 
 
 class ResourceModel(BaseImmutableRootModel):
-    root: ResourceEverythingModel | ResourceSpecificModel
+    root: Annotated[
+        Annotated[ResourceEverythingModel, Tag("everything")] | Annotated[ResourceSpecificModel, Tag("project")],
+        _field_presence_discriminator("everything", "project"),
+    ]
+
+    @model_validator(mode="before")
+    @classmethod
+    def intern_everything(cls, v: Any) -> Any:
+        # See SubjectModel.intern_everyone(...)
+        if isinstance(v, dict) and len(v) == 1 and v.get("everything") is True:
+            return RESOURCE_EVERYTHING.root
+        return v
 
 
 RESOURCE_EVERYTHING = ResourceModel.model_validate(ResourceEverythingModel(everything=True))
@@ -123,6 +236,17 @@ class GrantModel(BaseImmutableModel):
         # make set serialization have a consistent order
         return sorted(permissions)
 
+    # Expiry as a POSIX timestamp (infinity if the grant never expires), computed at validation time so grant expiry can
+    # be checked with a float comparison rather than a timezone-aware datetime comparison during policy evaluation.
+    _expiry_timestamp: float = PrivateAttr()
+
+    def model_post_init(self, _context: Any) -> None:
+        self._expiry_timestamp = math.inf if self.expiry is None else self.expiry.timestamp()
+
+    @property
+    def expiry_timestamp(self) -> float:
+        return self._expiry_timestamp
+
 
 class StoredGrantModel(GrantModel):
     id: int
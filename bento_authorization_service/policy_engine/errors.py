@@ -0,0 +1,17 @@
+from ..logger import logger
+
+__all__ = [
+    "resource_not_implemented",
+    "subject_not_implemented",
+]
+
+
+def resource_not_implemented(unimpl_for: str) -> NotImplementedError:
+    err = f"Unimplemented handling for {unimpl_for} (missing everything|project)"
+    logger.error(err)
+    return NotImplementedError(err)
+
+
+def subject_not_implemented(err: str) -> NotImplementedError:
+    logger.error(err)
+    return NotImplementedError(err)
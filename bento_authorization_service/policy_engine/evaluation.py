@@ -1,12 +1,16 @@
-import itertools
-import json
+import bisect
+import logging
+import math
+import orjson
+import time
 
 from bento_lib.auth.permissions import PERMISSIONS_BY_STRING, Permission
 from bento_lib.search.data_structure import check_ast_against_data_structure
-from bento_lib.search.queries import convert_query_to_ast_and_preprocess
-from datetime import datetime, timezone
+from collections import OrderedDict
+from datetime import datetime
+from functools import lru_cache
 
-from typing import Callable, Generator, Iterable
+from typing import Any, Callable, Generator, Iterable
 from typing_extensions import TypedDict  # TODO: py3.12: remove and uninstall library
 
 from ..db import Database
@@ -30,6 +34,8 @@ from ..models import (
     GrantModel,
 )
 from ..logger import logger
+from .errors import resource_not_implemented, subject_not_implemented
+from .grant_index import GrantIndex, get_grant_index, get_subject_grant_index
 
 
 __all__ = [
@@ -42,6 +48,9 @@ __all__ = [
     "check_if_token_matches_subject",
     "resource_is_equivalent_or_contained",
     "filter_matching_grants",
+    "filter_token_matching_grants",
+    "get_token_grant_index",
+    "determine_resource_permissions",
     "determine_permissions",
     "evaluate_on_resource_and_permission",
     "evaluate",
@@ -102,12 +111,15 @@ def check_token_against_issuer_based_model_obj(token_data: TokenData | None, m:
     if m.iss != td.get("iss"):  # Token issuer isn't the same as this member, so skip this entry early.
         return False
 
-    if isinstance(m, IssuerAndClientModel):
+    # Models are checked by exact type (rather than isinstance) here and in resource_is_equivalent_or_contained(...),
+    # since these checks are in the policy evaluation hot path and subclasses of the models aren't supported anyway.
+    m_type = type(m)
+    if m_type is IssuerAndClientModel:
         if m.client == td.get("azp"):
             # Issuer and client IDs match, so this token bearer is a member of this group
             return True
         # Otherwise, do nothing & keep checking members
-    elif isinstance(m, IssuerAndSubjectModel):
+    elif m_type is IssuerAndSubjectModel:
         if m.sub == td.get("sub"):
             # Issuer and subjects match, so this token bearer is a member of this group
             return True
@@ -134,18 +146,21 @@ def check_if_token_is_in_group(
     if token_data is None:
         return False  # anonymous users cannot CURRENTLY be part of groups
 
-    if (g_expiry := group.expiry) is not None and g_expiry <= get_now().astimezone(tz=timezone.utc):
+    if group.expiry_timestamp <= get_now().timestamp():
         return False  # Expired group, no membership
 
     membership: GroupMembership = group.membership
 
     if isinstance(membership, GroupMembershipMembers):
         # Check if any issuer and (client ID | subject ID) match --> token bearer is a member of this group
-        return any(check_token_against_issuer_based_model_obj(token_data, member.root) for member in membership.members)
+        iss = token_data.get("iss")
+        client_pair = (iss, token_data.get("azp"))
+        sub_pair = (iss, token_data.get("sub"))
+        return client_pair in membership.iss_client_pairs or sub_pair in membership.iss_sub_pairs
 
     elif isinstance(membership, GroupMembershipExpr):
         return check_ast_against_data_structure(
-            ast=convert_query_to_ast_and_preprocess(membership.expr),
+            ast=membership.ast,
             data_structure=token_data,
             schema=TOKEN_DATA,
             internal=True,
@@ -156,9 +171,31 @@ def check_if_token_is_in_group(
         raise NotImplementedError("Group membership is not one of members[], expr")
 
 
-def _subject_not_implemented(err: str) -> NotImplementedError:
-    logger.error(err)
-    return NotImplementedError(err)
+def _everyone_subject_matches(_gd: dict[int, StoredGroupModel], _td: TokenData | None, s: SubjectEveryoneModel):
+    # If the grant applies to everyone, it automatically includes the current token/anonymous user.
+    return s.everyone
+
+
+def _group_subject_matches(groups_dict: dict[int, StoredGroupModel], td: TokenData | None, s: SubjectGroupModel):
+    # If the grant applies to a specific Group, check if the token is a member of that group.
+    if (group_def := groups_dict.get(s.group)) is not None:
+        return check_if_token_is_in_group(td, group_def)  # Will validate group expiry too
+    logger.error("Invalid subject encountered: %s (group not found: %s)", s, s.group)
+    raise InvalidSubject(str(s))
+
+
+def _issuer_based_subject_matches(_gd: dict[int, StoredGroupModel], td: TokenData | None, s: BaseIssuerModel):
+    # Check the specifics of the grant to see if there is an issuer/client or issuer/subject match.
+    return check_token_against_issuer_based_model_obj(td, s)
+
+
+# Subject matching functions by (exact) subject model type - one dictionary lookup rather than an isinstance(...) chain.
+_SUBJECT_MATCHERS: dict[type, Callable[[dict[int, StoredGroupModel], TokenData | None, Any], bool]] = {
+    SubjectEveryoneModel: _everyone_subject_matches,
+    SubjectGroupModel: _group_subject_matches,
+    IssuerAndClientModel: _issuer_based_subject_matches,
+    IssuerAndSubjectModel: _issuer_based_subject_matches,
+}
 
 
 def check_if_token_matches_subject(
@@ -166,29 +203,10 @@ def check_if_token_matches_subject(
     token_data: TokenData | None,
     subject: SubjectModel,
 ) -> bool:
-    # First, check if the subject matches.
-    #  - If the grant applies to everyone, it automatically includes the current token/anonymous user.
-    #  - Then, check if the grant applies to a specific Group. Then, check if the token is a member of that group.
-    #  - Otherwise, check the specifics of the grant to see if there is an issuer/client or issuer/subject match.
-
     s = subject.root
-    if isinstance(s, SubjectEveryoneModel) and s.everyone:
-        return True
-    elif isinstance(s, SubjectGroupModel):
-        if (group_def := groups_dict.get(s.group)) is not None:
-            return check_if_token_is_in_group(token_data, group_def)  # Will validate group expiry too
-        logger.error(f"Invalid subject encountered: {subject} (group not found: {s.group})")
-        raise InvalidSubject(str(subject))
-    elif isinstance(s, BaseIssuerModel):
-        return check_token_against_issuer_based_model_obj(token_data, s)
-    else:
-        raise _subject_not_implemented(f"Can only handle everyone|group|iss+client|iss+sub subjects but got {s}")
-
-
-def _resource_not_implemented(unimpl_for: str) -> NotImplementedError:
-    err_ = f"Unimplemented handling for {unimpl_for} (missing everything|project)"
-    logger.error(err_)
-    return NotImplementedError(err_)  # TODO: indicate if requested or grant
+    if (matcher := _SUBJECT_MATCHERS.get(type(s))) is None:
+        raise subject_not_implemented(f"Can only handle everyone|group|iss+client|iss+sub subjects but got {s}")
+    return matcher(groups_dict, token_data, s)
 
 
 # TODO: make resource_is_equivalent_or_contained part of a Bento-specific module/class
@@ -206,20 +224,22 @@ def resource_is_equivalent_or_contained(requested_resource: ResourceModel, grant
     # Check if a grant resource matches the requested resource.
 
     rr = requested_resource.root
-    rr_is_everything = isinstance(rr, ResourceEverythingModel)
+    rr_type = type(rr)
+    rr_is_everything = rr_type is ResourceEverythingModel
     gr = grant_resource.root
+    gr_type = type(gr)
 
     # TODO: idea for making this more generic
     #  Have concepts of resources with top-level ID specifier (project) and a list of lists of narrowing parameters
     #  like ("project", ("dataset", "data_type")) as a generic way of representing a resource hierarchy.
 
     #   - First, if the grant applies to everything. If it does, it automatically matches the specified resource.
-    if isinstance(gr, ResourceEverythingModel):
-        if rr_is_everything or isinstance(rr, ResourceSpecificModel):
+    if gr_type is ResourceEverythingModel:
+        if rr_is_everything or rr_type is ResourceSpecificModel:
             return True
-        raise _resource_not_implemented(f"resource request: {rr}")
+        raise resource_not_implemented(f"resource request: {rr}")
 
-    elif isinstance(gr, ResourceSpecificModel):
+    elif gr_type is ResourceSpecificModel:
         # we have {project: ..., possibly with dataset, data_type}
         # The grant applies to a project, or dataset, or project data type, or dataset data type.
 
@@ -230,7 +250,7 @@ def resource_is_equivalent_or_contained(requested_resource: ResourceModel, grant
         if rr_is_everything:
             # They want access to everything/something node-wide, but this grant is for something specific. No!
             return False
-        elif isinstance(rr, ResourceSpecificModel):
+        elif rr_type is ResourceSpecificModel:
             # The requested resource is at least a project, or possibly more specific:
             #   - project, or
             #   - project + dataset, or
@@ -248,10 +268,10 @@ def resource_is_equivalent_or_contained(requested_resource: ResourceModel, grant
                 and (g_data_type is None or g_data_type == rr.data_type)
             )
         else:  # requested resource doesn't match any known resource pattern, somehow.
-            raise _resource_not_implemented(f"resource request: {rr}")
+            raise resource_not_implemented(f"resource request: {rr}")
 
     else:  # grant resource hasn't been implemented in this function
-        raise _resource_not_implemented(f"grant resource: {grant_resource}")
+        raise resource_not_implemented(f"grant resource: {grant_resource}")
 
 
 def filter_matching_grants(
@@ -271,16 +291,16 @@ def filter_matching_grants(
     :return: TODO
     """
 
-    dt_now = get_now().astimezone(tz=timezone.utc)
+    now_ts = get_now().timestamp()
 
-    for g in grants:
-        if g.expiry is not None and g.expiry <= dt_now:
+    # Use the (resource-based) grant index to narrow things down to only the grants which apply to the requested
+    # resource, rather than checking the resource of every grant.
+    for g in get_grant_index(grants).resource_matching_grants(requested_resource):
+        if g.expiry_timestamp <= now_ts:
             continue  # Skip expired grants
 
         try:
-            subject_matches: bool = check_if_token_matches_subject(groups_dict, token_data, g.subject)
-            resource_matches: bool = resource_is_equivalent_or_contained(requested_resource, g.resource)
-            if subject_matches and resource_matches:
+            if check_if_token_matches_subject(groups_dict, token_data, g.subject):
                 # Grant applies to the token in question, and the requested resource in question, so it is part of the
                 # set of grants which determine the permissions the token bearer has on this resource.
                 yield g
@@ -289,10 +309,63 @@ def filter_matching_grants(
             pass
 
 
-def _permission_and_gives_from_string(p: str) -> Iterable[Permission]:
-    perm = PERMISSIONS_BY_STRING[p]
-    yield perm
-    yield from perm.gives
+def filter_token_matching_grants(
+    grants: tuple[GrantModel, ...],
+    groups_dict: dict[int, StoredGroupModel],
+    token_data: TokenData | None,
+    get_now: Callable[[], datetime] = datetime.now,
+) -> tuple[GrantModel, ...]:
+    """
+    Filters grants down to the unexpired ones whose subject matches the token, regardless of resource. Neither of these
+    checks depend on the requested resource, so this can be done once for many resources.
+    :param grants: List of grants to filter out non-matches.
+    :param groups_dict: Dictionary of group IDs and group definitions.
+    :param token_data: Parsed token data of a user or automated script, or None if an anonymous request.
+    :param get_now: Function returning the current datetime, for checking grant/group expiry.
+    :return: Tuple of grants which apply to the token.
+    """
+
+    now_ts = get_now().timestamp()
+
+    # Rather than checking the subject of every grant, use the (subject-based) grant index to look up the grants for
+    # everyone and for the token's issuer/client and issuer/subject pairs, and check each group with grants only once.
+    idx = get_subject_grant_index(grants)
+    td = token_data or {}
+    iss = td.get("iss")
+
+    matching: list[int] = [
+        *idx.everyone,
+        *idx.by_iss_client.get((iss, td.get("azp")), ()),
+        *idx.by_iss_sub.get((iss, td.get("sub")), ()),
+    ]
+
+    for group_id, group_grant_idxs in idx.by_group.items():
+        if (group_def := groups_dict.get(group_id)) is None:
+            # Missing group - skip any grants for it
+            logger.error("Invalid subject encountered: group not found: %s", group_id)
+            continue
+        if check_if_token_is_in_group(token_data, group_def, get_now):  # Will validate group expiry too
+            matching.extend(group_grant_idxs)
+
+    matching.sort()  # Keep grants in their original order
+    return tuple(g for i in matching if (g := grants[i]).expiry_timestamp > now_ts)  # Skip expired grants
+
+
+# Permission string -> the permission itself, plus all the permissions it gives. This is static, so we can compute it
+# once here rather than for every grant permission on every evaluation.
+_PERMISSION_CLOSURES: dict[str, frozenset[Permission]] = {
+    k: frozenset((p, *p.gives)) for k, p in PERMISSIONS_BY_STRING.items()
+}
+
+
+@lru_cache(maxsize=1024)
+def _permission_set_closure(permissions: frozenset[str]) -> frozenset[Permission]:
+    # Grants tend to share a small number of distinct permission sets, so compute the closure of each set only once.
+    return frozenset().union(*(_PERMISSION_CLOSURES[p] for p in permissions))
+
+
+def _permissions_from_grants(grants: Iterable[GrantModel]) -> frozenset[Permission]:
+    return frozenset().union(*(_permission_set_closure(g.permissions) for g in grants))
 
 
 def determine_permissions(
@@ -310,13 +383,9 @@ def determine_permissions(
     :return: The permissions frozen set
     """
 
-    return frozenset(
-        itertools.chain.from_iterable(
-            _permission_and_gives_from_string(p)
-            for g in filter_matching_grants(grants, groups_dict, token_data, requested_resource)
-            for p in g.permissions
-        )
-    )
+    # Go through the (cached) index of the grants which apply to the token, as evaluate() does, so that repeated calls
+    # for the same token and policy snapshot don't re-match every grant's subject.
+    return determine_resource_permissions(get_token_grant_index(grants, groups_dict, token_data), requested_resource)
 
 
 LOG_USER_STR_FIELDS: tuple[str, ...] = ("iss", "azp", "sub")
@@ -336,6 +405,89 @@ def evaluate_on_resource_and_permission(
     return permission in permissions
 
 
+TOKEN_GRANTS_CACHE_SIZE = 1024  # Maximum number of distinct tokens to keep applicable grant indices for
+TOKEN_GRANTS_CACHE_MAX_TTL = 10  # seconds
+
+# Token data (serialized with sorted keys) -> (index of the grants which apply to the token, cache entry expiry).
+# Entries are only valid for the grants/groups snapshot they were computed from; see get_token_grant_index(...)
+_token_grants_cache: OrderedDict[bytes, tuple[GrantIndex, float]] = OrderedDict()
+# (grants, groups dict, sorted group expiry timestamps) which the cache entries above were computed from
+_token_grants_cache_source: tuple[tuple[GrantModel, ...], dict[int, StoredGroupModel], list[float]] | None = None
+
+
+def get_token_grant_index(
+    grants: tuple[GrantModel, ...],
+    groups_dict: dict[int, StoredGroupModel],
+    token_data: TokenData | None,
+) -> GrantIndex:
+    """
+    Returns an index (by resource) of the grants which apply to a token, re-using a recently-computed index if the same
+    token data is evaluated again against the same grants/groups snapshot.
+    :param grants: All grants, as a snapshot from Database.get_grants_and_groups_dict(...)
+    :param groups_dict: Dictionary of group IDs and group definitions, from the same snapshot as the grants.
+    :param token_data: Parsed token data of a user or automated script, or None if an anonymous request.
+    :return: Index of the grants which apply to the token.
+    """
+
+    global _token_grants_cache_source
+
+    cache = _token_grants_cache
+
+    # Snapshots are re-used (i.e., are the same objects) until the policy version changes, so compare by identity.
+    if (source := _token_grants_cache_source) is None or source[0] is not grants or source[1] is not groups_dict:
+        cache.clear()
+        group_expiries = sorted(g.expiry_timestamp for g in groups_dict.values() if g.expiry is not None)
+        source = (grants, groups_dict, group_expiries)
+        _token_grants_cache_source = source
+
+    # Key on ALL the token data, not just the issuer/subject, since group membership expressions can use any field.
+    key = orjson.dumps(token_data, option=orjson.OPT_SORT_KEYS)
+    now = time.time()
+
+    if (entry := cache.get(key)) is not None and entry[1] > now:
+        cache.move_to_end(key)
+        return entry[0]
+
+    token_grants = filter_token_matching_grants(grants, groups_dict, token_data)
+    token_grant_index = GrantIndex(token_grants)
+
+    # Grants and group memberships can only stop applying to a token over time (by expiring), so an entry is valid until
+    # the earliest expiry of any grant it contains or the next expiry of any group - or the max TTL, whichever is first.
+    grants_expiry = min((g.expiry_timestamp for g in token_grants), default=math.inf)  # No grants: never "expires"
+    entry_expiry = min(now + TOKEN_GRANTS_CACHE_MAX_TTL, grants_expiry)
+    group_expiries = source[2]
+    if (next_group_expiry_idx := bisect.bisect_right(group_expiries, now)) < len(group_expiries):
+        entry_expiry = min(entry_expiry, group_expiries[next_group_expiry_idx])
+
+    cache[key] = (token_grant_index, entry_expiry)
+    cache.move_to_end(key)
+    if len(cache) > TOKEN_GRANTS_CACHE_SIZE:
+        cache.popitem(last=False)  # Evict least-recently-used token
+
+    return token_grant_index
+
+
+def determine_resource_permissions(
+    token_grant_index: GrantIndex, requested_resource: ResourceModel
+) -> frozenset[Permission]:
+    """
+    Given an index of the grants which apply to a token (see get_token_grant_index(...)) and a resource, return the
+    permissions the token has on the resource.
+    :param token_grant_index: Index of the grants which apply to the token.
+    :param requested_resource: The resource the token wishes to operate on.
+    :return: The permissions frozen set
+    """
+    return _permissions_from_grants(token_grant_index.resource_matching_grants(requested_resource))
+
+
+def _evaluate_on_resource(
+    token_grant_index: GrantIndex, resource: ResourceModel, permissions: Iterable[Permission]
+) -> tuple[bool, ...]:
+    # Determine the permissions the token has on the resource once, then check each permission against that set.
+    resource_permissions = determine_resource_permissions(token_grant_index, resource)
+    return tuple(p in resource_permissions for p in permissions)
+
+
 LOG_SUBJECT_ANONYMOUS = {"anonymous": True}
 
 
@@ -355,26 +507,33 @@ async def evaluate(
     # If we instead receive already parsed token data, we just use that instead:
     token_data: TokenData | None = (await idp_manager.decode(token)) if isinstance(token, str) else token
 
-    # Fetch grants + groups from the database in parallel
-    grants, groups_dict = await db.get_grants_and_groups_dict()
-
-    # Determine the permissions evaluation matrix
-    evaluation_matrix = tuple(
-        tuple(evaluate_on_resource_and_permission(grants, groups_dict, token_data, r, p) for p in permissions)
-        for r in resources
-    )
-
-    # Log the decision made, with some user data
-    user_str = LOG_SUBJECT_ANONYMOUS
-    if token_data is not None:
-        # noinspection PyTypedDict
-        user_str = {k: token_data.get(k) for k in LOG_USER_STR_FIELDS}
-    log_obj = {
-        "user": user_str,
-        "resources": [r.model_dump(mode="json") for r in resources],
-        "permissions": permissions,
-        "decisions": evaluation_matrix,
-    }
-    logger.info(f"evaluate: {json.dumps(log_obj)})")
+    evaluation_matrix: tuple[tuple[bool, ...], ...]
+    if not resources or not permissions:
+        # Nothing to evaluate: the matrix is either empty or has an empty row for each resource, so we don't need to
+        # fetch anything from the database. The token is still decoded above, so an invalid token fails the same way.
+        evaluation_matrix = tuple(() for _ in resources)
+    else:
+        # Fetch grants + groups from the database in parallel
+        grants, groups_dict = await db.get_grants_and_groups_dict()
+
+        # Determine the permissions evaluation matrix. Whether a grant applies to the token (subject match + expiry)
+        # doesn't depend on the resource or permission, so filter the grants down to the token's grants once, up front
+        # (or re-use a recent result for the same token & policy snapshot), and index those by resource.
+        token_grant_index = get_token_grant_index(grants, groups_dict, token_data)
+        evaluation_matrix = tuple(_evaluate_on_resource(token_grant_index, r, permissions) for r in resources)
+
+    # Log the decision made, with some user data - only building the log object if it's actually going to be logged.
+    if logger.isEnabledFor(logging.INFO):
+        user_str = LOG_SUBJECT_ANONYMOUS
+        if token_data is not None:
+            # noinspection PyTypedDict
+            user_str = {k: token_data.get(k) for k in LOG_USER_STR_FIELDS}
+        log_obj = {
+            "user": user_str,
+            "resources": [r.model_dump() for r in resources],
+            "permissions": permissions,
+            "decisions": evaluation_matrix,
+        }
+        logger.info("evaluate: %s", orjson.dumps(log_obj).decode())
 
     return evaluation_matrix
@@ -0,0 +1,144 @@
+from typing import Sequence
+
+from ..models import (
+    GrantModel,
+    IssuerAndClientModel,
+    IssuerAndSubjectModel,
+    ResourceEverythingModel,
+    ResourceModel,
+    ResourceSpecificModel,
+    SubjectEveryoneModel,
+    SubjectGroupModel,
+)
+from .errors import resource_not_implemented, subject_not_implemented
+
+__all__ = [
+    "GrantIndex",
+    "get_grant_index",
+    "SubjectGrantIndex",
+    "get_subject_grant_index",
+]
+
+
+class GrantIndex:
+    # Index of a set of grants by the resource each one applies to, so we can find the grants which may apply to a
+    # requested resource without checking every single grant. Grants are stored by their index in the grants sequence:
+    #  - grants on everything go in their own bucket, since they apply to any requested resource;
+    #  - grants on a specific resource go in a project -> dataset -> data type trie, where a None key at the dataset or
+    #    data type level means the grant applies to all datasets / data types.
+
+    __slots__ = ("grants", "_everything", "_by_project")
+
+    def __init__(self, grants: Sequence[GrantModel]):
+        self.grants: Sequence[GrantModel] = grants
+
+        everything: list[int] = []
+        by_project: dict[str, dict[str | None, dict[str | None, list[int]]]] = {}
+
+        for i, g in enumerate(grants):
+            gr = g.resource.root
+            gr_type = type(gr)  # Exact type checks - see resource_is_equivalent_or_contained(...)
+            if gr_type is ResourceEverythingModel:
+                everything.append(i)
+            elif gr_type is ResourceSpecificModel:
+                by_project.setdefault(gr.project, {}).setdefault(gr.dataset, {}).setdefault(gr.data_type, []).append(i)
+            else:
+                raise resource_not_implemented(f"grant resource: {g.resource}")
+
+        self._everything: tuple[int, ...] = tuple(everything)
+        self._by_project = by_project
+
+    def resource_matching_indices(self, requested_resource: ResourceModel) -> tuple[int, ...]:
+        """
+        Finds the grants which apply to a requested resource, i.e., the grants whose resource is equivalent to or
+        contains the requested resource. This must stay consistent with resource_is_equivalent_or_contained(...).
+        :param requested_resource: The resource being requested.
+        :return: Indices (in order) of grants which apply to the requested resource.
+        """
+
+        rr = requested_resource.root
+        rr_type = type(rr)
+
+        if rr_type is ResourceEverythingModel:
+            # Only grants on everything apply to a request for everything.
+            return self._everything
+
+        if rr_type is not ResourceSpecificModel:
+            raise resource_not_implemented(f"resource request: {rr}")
+
+        res: list[int] = list(self._everything)
+
+        # Walk down the trie, taking both the 'all' (None) branch and the requested value's branch at each level.
+        if (datasets := self._by_project.get(rr.project)) is not None:
+            for dataset_key in (None,) if rr.dataset is None else (None, rr.dataset):
+                if (data_types := datasets.get(dataset_key)) is None:
+                    continue
+                for data_type_key in (None,) if rr.data_type is None else (None, rr.data_type):
+                    res.extend(data_types.get(data_type_key, ()))
+
+        res.sort()
+        return tuple(res)
+
+    def resource_matching_grants(self, requested_resource: ResourceModel) -> tuple[GrantModel, ...]:
+        grants = self.grants
+        return tuple(grants[i] for i in self.resource_matching_indices(requested_resource))
+
+
+# Most recently built grant index. Grants are usually fetched as one tuple per policy evaluation (or re-used as a
+# snapshot across evaluations), so keying on the identity of the grants sequence is enough to avoid re-indexing.
+_last_grant_index: GrantIndex | None = None
+
+
+def get_grant_index(grants: Sequence[GrantModel]) -> GrantIndex:
+    global _last_grant_index
+    if (idx := _last_grant_index) is None or idx.grants is not grants:
+        idx = GrantIndex(grants)
+        _last_grant_index = idx
+    return idx
+
+
+class SubjectGrantIndex:
+    # Index of a set of grants by the subject each one applies to, so we can find the grants which apply to a token by
+    # looking up the token's issuer/client and issuer/subject pairs, and checking each referenced group once, rather
+    # than checking the subject of every single grant. Like GrantIndex, grants are stored by their index.
+
+    __slots__ = ("grants", "everyone", "by_group", "by_iss_client", "by_iss_sub")
+
+    def __init__(self, grants: Sequence[GrantModel]):
+        self.grants: Sequence[GrantModel] = grants
+
+        everyone: list[int] = []
+        by_group: dict[int, list[int]] = {}
+        by_iss_client: dict[tuple[str, str], list[int]] = {}
+        by_iss_sub: dict[tuple[str, str], list[int]] = {}
+
+        for i, g in enumerate(grants):
+            s = g.subject.root
+            s_type = type(s)  # Exact type checks - see resource_is_equivalent_or_contained(...)
+            if s_type is SubjectEveryoneModel:
+                everyone.append(i)
+            elif s_type is SubjectGroupModel:
+                by_group.setdefault(s.group, []).append(i)
+            elif s_type is IssuerAndClientModel:
+                by_iss_client.setdefault((s.iss, s.client), []).append(i)
+            elif s_type is IssuerAndSubjectModel:
+                by_iss_sub.setdefault((s.iss, s.sub), []).append(i)
+            else:
+                raise subject_not_implemented(f"Can only handle everyone|group|iss+client|iss+sub subjects but got {s}")
+
+        self.everyone: tuple[int, ...] = tuple(everyone)
+        self.by_group: dict[int, tuple[int, ...]] = {k: tuple(v) for k, v in by_group.items()}
+        self.by_iss_client: dict[tuple[str, str], tuple[int, ...]] = {k: tuple(v) for k, v in by_iss_client.items()}
+        self.by_iss_sub: dict[tuple[str, str], tuple[int, ...]] = {k: tuple(v) for k, v in by_iss_sub.items()}
+
+
+# See _last_grant_index
+_last_subject_grant_index: SubjectGrantIndex | None = None
+
+
+def get_subject_grant_index(grants: Sequence[GrantModel]) -> SubjectGrantIndex:
+    global _last_subject_grant_index
+    if (idx := _last_subject_grant_index) is None or idx.grants is not grants:
+        idx = SubjectGrantIndex(grants)
+        _last_subject_grant_index = idx
+    return idx
@@ -53,10 +53,10 @@ async def use_token_data_or_return_error_state(
     try:
         token_data = (await idp_manager.decode(authorization.credentials)) if authorization is not None else None
     except jwt.InvalidAudienceError as e:
-        logger.warning(f"Got token with bad audience (exception: {repr(e)})")
+        logger.warning("Got token with bad audience (exception: %r)", e)
         return err_state
     except jwt.ExpiredSignatureError:
-        logger.warning(f"Got expired token")
+        logger.warning("Got expired token")
         return err_state
     except jwt.DecodeError:
         # Actually throw an HTTP error for this one
@@ -7,7 +7,12 @@ from bento_authorization_service.db import DatabaseDependency
 from bento_authorization_service.dependencies import OptionalBearerToken
 from bento_authorization_service.idp_manager import IdPManagerDependency
 from bento_authorization_service.models import ResourceModel, StoredGrantModel, StoredGroupModel
-from bento_authorization_service.policy_engine.evaluation import TokenData, determine_permissions
+from bento_authorization_service.policy_engine.evaluation import (
+    TokenData,
+    determine_resource_permissions,
+    get_token_grant_index,
+)
+from bento_authorization_service.policy_engine.grant_index import GrantIndex
 
 from .common import check_non_bearer_token_data_use, use_token_data_or_return_error_state
 from .router import policy_router
@@ -22,21 +27,8 @@ class ListPermissionsResponse(BaseModel):
     result: list[list[str]]
 
 
-def list_permissions_for_resource(
-    grants: tuple[StoredGrantModel, ...],
-    groups: dict[int, StoredGroupModel],
-    token_data: dict | None,
-    r: ResourceModel,
-) -> list[str]:
-    return sorted(
-        str(p)
-        for p in determine_permissions(
-            grants=grants,
-            groups_dict=groups,
-            token_data=token_data,
-            requested_resource=r,
-        )
-    )
+def list_permissions_for_resource(token_grant_index: GrantIndex, r: ResourceModel) -> list[str]:
+    return sorted(str(p) for p in determine_resource_permissions(token_grant_index, r))
 
 
 @policy_router.post("/permissions")
@@ -72,8 +64,11 @@ async def req_list_permissions(
         groups: dict[int, StoredGroupModel]
         grants, groups = await db.get_grants_and_groups_dict()
 
+        # Find the grants which apply to the token once, then determine the permissions for each resource from them.
+        token_grant_index = get_token_grant_index(grants, groups, token_data)
+
         return ListPermissionsResponse(
-            result=[list_permissions_for_resource(grants, groups, token_data, r) for r in r_resources],
+            result=[list_permissions_for_resource(token_grant_index, r) for r in r_resources],
         )
 
     # TODO: real error response
@@ -89,13 +84,8 @@ class PermissionsMapResponse(BaseModel):
     result: list[dict[str, bool]]
 
 
-def build_permissions_map(
-    grants: tuple[StoredGrantModel, ...],
-    groups: dict[int, StoredGroupModel],
-    token_data: TokenData,
-    resource: ResourceModel,
-) -> dict[Permission, bool]:
-    resource_permissions = set(list_permissions_for_resource(grants, groups, token_data, resource))
+def build_permissions_map(token_grant_index: GrantIndex, resource: ResourceModel) -> dict[Permission, bool]:
+    resource_permissions = set(list_permissions_for_resource(token_grant_index, resource))
     valid_permissions = valid_permissions_for_resource(resource.model_dump(exclude_none=True))
     return {p: p in resource_permissions for p in valid_permissions}
 
@@ -133,8 +123,11 @@ async def req_permissions_map(
         groups: dict[int, StoredGroupModel]
         grants, groups = await db.get_grants_and_groups_dict()
 
+        # See note in req_list_permissions(...)
+        token_grant_index = get_token_grant_index(grants, groups, token_data)
+
         return PermissionsMapResponse(
-            result=[build_permissions_map(grants, groups, token_data, r) for r in r_resources],
+            result=[build_permissions_map(token_grant_index, r) for r in r_resources],
         )
 
     # TODO: real error response
@@ -41,3 +41,43 @@ CREATE TABLE IF NOT EXISTS groups (
 
     CONSTRAINT group_name_unique UNIQUE ("name")
 );
+
+-- Single-row counter which is bumped on any change to grants or groups, so that service instances can cheaply check
+-- whether a cached snapshot of the policy (grants + groups) is still current.
+CREATE TABLE IF NOT EXISTS policy_version (
+    "id"      BOOLEAN PRIMARY KEY DEFAULT TRUE CHECK ("id"),  -- Enforces a single row
+    "version" BIGINT  NOT NULL DEFAULT 0
+);
+INSERT INTO policy_version DEFAULT VALUES ON CONFLICT DO NOTHING;
+
+CREATE OR REPLACE FUNCTION bump_policy_version() RETURNS TRIGGER AS $$
+BEGIN
+    UPDATE policy_version SET "version" = "version" + 1;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Only create the triggers if they don't exist yet, rather than dropping & re-creating them on every startup: that
+-- would lock these tables, and leave a window where writes (e.g., from another service instance) don't bump the version.
+DO $$
+DECLARE
+    t TEXT;
+BEGIN
+    FOREACH t IN ARRAY ARRAY['grants', 'grant_permissions', 'groups'] LOOP
+        IF NOT EXISTS (
+            SELECT 1 FROM pg_trigger WHERE tgname = t || '_bump_policy_version' AND tgrelid = t::regclass
+        ) THEN
+            BEGIN
+                EXECUTE format(
+                    'CREATE TRIGGER %I AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON %I '
+                    'FOR EACH STATEMENT EXECUTE FUNCTION bump_policy_version()',
+                    t || '_bump_policy_version',
+                    t
+                );
+            EXCEPTION WHEN duplicate_object THEN
+                NULL;  -- Created concurrently by another service instance starting up
+            END;
+        END IF;
+    END LOOP;
+END;
+$$;
@@ -1,3 +1,4 @@
+import math
 import pytest
 
 from bento_lib.auth.permissions import P_QUERY_DATA, P_QUERY_PROJECT_LEVEL_BOOLEAN, P_DELETE_DATA
@@ -14,6 +15,8 @@ from bento_authorization_service.policy_engine.evaluation import (
     check_if_token_matches_subject,
     resource_is_equivalent_or_contained,
     filter_matching_grants,
+    filter_token_matching_grants,
+    get_token_grant_index,
     determine_permissions,
     evaluate,
 )
@@ -82,6 +85,11 @@ def test_invalid_group_membership():
 
 def test_group_expiry():
     assert not check_if_token_is_in_group(sd.TEST_TOKEN, sd.TEST_EXPIRED_GROUP)
+    assert sd.TEST_EXPIRED_GROUP.expiry_timestamp == sd.TEST_EXPIRED_GROUP.expiry.timestamp()
+    # Same group without an expiry: member
+    unexpired_group = sd.TEST_EXPIRED_GROUP.model_copy(update={"expiry": None})
+    assert unexpired_group.expiry_timestamp == math.inf
+    assert check_if_token_is_in_group(sd.TEST_TOKEN, unexpired_group)
 
 
 @pytest.mark.parametrize("group, is_member", sd.TEST_GROUPS)
@@ -268,6 +276,50 @@ def test_grant_filtering_2():
     assert len(matching_token) == 0  # Foreign issuer, not in group 0
 
 
+def test_token_grant_filtering():
+    args = (
+        (
+            sd.TEST_GRANT_EVERYONE_EVERYTHING_QUERY_DATA,
+            sd.TEST_GRANT_EVERYONE_EVERYTHING_QUERY_DATA_EXPIRED,  # Won't apply - expired
+            sd.TEST_GRANT_GROUP_0_PROJECT_1_QUERY_DATA,
+        ),
+        sd.TEST_GROUPS_DICT,
+    )
+    everyone_only = (sd.TEST_GRANT_EVERYONE_EVERYTHING_QUERY_DATA,)
+    # Foreign issuer, not in group 0
+    assert filter_token_matching_grants(*args, sd.TEST_TOKEN_FOREIGN_ISS) == everyone_only
+    # Missing group definition, so the group grant doesn't apply
+    assert filter_token_matching_grants(args[0], {}, sd.TEST_TOKEN) == everyone_only
+
+
+def test_token_grant_index_cache():
+    grants = (sd.TEST_GRANT_EVERYONE_EVERYTHING_QUERY_DATA, sd.TEST_GRANT_GROUP_0_PROJECT_1_QUERY_DATA)
+
+    idx = get_token_grant_index(grants, sd.TEST_GROUPS_DICT, sd.TEST_TOKEN)
+    assert len(idx.grants) == 2
+    # Same token data + snapshot: re-used
+    assert get_token_grant_index(grants, sd.TEST_GROUPS_DICT, dict(sd.TEST_TOKEN)) is idx
+    # Different token data: not re-used
+    idx_foreign = get_token_grant_index(grants, sd.TEST_GROUPS_DICT, sd.TEST_TOKEN_FOREIGN_ISS)
+    assert idx_foreign is not idx
+    assert len(idx_foreign.grants) == 1
+    # New snapshot: not re-used
+    assert get_token_grant_index(tuple(list(grants)), sd.TEST_GROUPS_DICT, sd.TEST_TOKEN) is not idx
+
+
+def test_token_grant_index_cache_no_matching_grants():
+    grants = (sd.TEST_GRANT_GROUP_0_PROJECT_1_QUERY_DATA,)
+
+    # No grants apply to the token: an empty index is returned (and cached) rather than erroring
+    idx = get_token_grant_index(grants, sd.TEST_GROUPS_DICT, sd.TEST_TOKEN_FOREIGN_ISS)
+    assert len(idx.grants) == 0
+    assert get_token_grant_index(grants, sd.TEST_GROUPS_DICT, sd.TEST_TOKEN_FOREIGN_ISS) is idx
+    # Same for anonymous requests
+    idx_anon = get_token_grant_index(grants, sd.TEST_GROUPS_DICT, None)
+    assert len(idx_anon.grants) == 0
+    assert get_token_grant_index(grants, sd.TEST_GROUPS_DICT, None) is idx_anon
+
+
 async def _eval_test_data(db: Database):
     group_id = await db.create_group(sd.TEST_GROUPS[0][0])
     grant_with_group = {
@@ -291,6 +343,10 @@ async def test_evaluate_function(db: Database, idp_manager: IdPManager, test_cli
     res = await evaluate(idp_manager, db, tkn, (sd.RESOURCE_PROJECT_1,), (P_QUERY_PROJECT_LEVEL_BOOLEAN,))
     assert res
 
+    # nothing to evaluate
+    assert (await evaluate(idp_manager, db, tkn, (), (P_QUERY_DATA,))) == ()
+    assert (await evaluate(idp_manager, db, tkn, (sd.RESOURCE_PROJECT_1, sd.RESOURCE_PROJECT_2), ())) == ((), ())
+
 
 # noinspection PyUnusedLocal
 @pytest.mark.asyncio
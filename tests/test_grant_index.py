@@ -0,0 +1,64 @@
+import pytest
+
+from bento_authorization_service.policy_engine.evaluation import (
+    check_if_token_matches_subject,
+    filter_token_matching_grants,
+    resource_is_equivalent_or_contained,
+)
+from bento_authorization_service.policy_engine.grant_index import (
+    GrantIndex,
+    get_grant_index,
+    SubjectGrantIndex,
+    get_subject_grant_index,
+)
+
+from . import shared_data as sd
+
+
+GRANTS = (
+    sd.TEST_GRANT_EVERYONE_EVERYTHING_QUERY_DATA,
+    sd.TEST_GRANT_GROUP_0_PROJECT_1_QUERY_DATA,
+    sd.TEST_GRANT_GROUP_0_PROJECT_2_QUERY_DATA,
+    sd.TEST_GRANT_DAVID_PROJECT_1_QUERY_DATA,
+    sd.SPECIAL_GRANT_DAVID_EVERYTHING_VIEW_EDIT_PERMISSIONS,
+)
+
+
+@pytest.mark.parametrize(
+    "resource",
+    (
+        sd.RESOURCE_EVERYTHING,
+        sd.RESOURCE_PROJECT_1,
+        sd.RESOURCE_PROJECT_1_DATASET_A,
+        sd.RESOURCE_PROJECT_1_PHENOPACKET,
+        sd.RESOURCE_PROJECT_2,
+    ),
+)
+def test_grant_index_matches_resource_check(resource):
+    # The index must give exactly the same results as checking every grant's resource one by one
+    idx = GrantIndex(GRANTS)
+    assert idx.resource_matching_grants(resource) == tuple(
+        g for g in GRANTS if resource_is_equivalent_or_contained(resource, g.resource)
+    )
+
+
+def test_grant_index_cache():
+    idx = get_grant_index(GRANTS)
+    assert get_grant_index(GRANTS) is idx
+    assert get_grant_index(tuple(GRANTS)) is idx  # same tuple object
+    assert get_grant_index(GRANTS[:2]) is not idx
+
+
+@pytest.mark.parametrize("token", (None, sd.TEST_TOKEN, sd.TEST_TOKEN_NOT_DAVID, sd.TEST_TOKEN_FOREIGN_ISS))
+def test_subject_grant_index_matches_subject_check(token):
+    # Filtering with the subject index must give exactly the same results as checking every grant's subject one by one
+    assert filter_token_matching_grants(GRANTS, sd.TEST_GROUPS_DICT, token) == tuple(
+        g for g in GRANTS if check_if_token_matches_subject(sd.TEST_GROUPS_DICT, token, g.subject)
+    )
+
+
+def test_subject_grant_index_cache():
+    idx = get_subject_grant_index(GRANTS)
+    assert isinstance(idx, SubjectGrantIndex)
+    assert get_subject_grant_index(GRANTS) is idx
+    assert get_subject_grant_index(GRANTS[:2]) is not idx
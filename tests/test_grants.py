@@ -1,4 +1,5 @@
 import json
+import math
 import pytest
 
 from bento_lib.auth import permissions
@@ -63,6 +64,18 @@ def test_bad_grant_permission_length():
         GrantModel(**{**sd.TEST_GRANT_DAVID_PROJECT_1_QUERY_DATA.model_dump(), "permissions": frozenset()})
 
 
+def test_grant_expiry_timestamp():
+    assert sd.TEST_GRANT_DAVID_PROJECT_1_QUERY_DATA.expiry_timestamp == math.inf
+    assert (
+        sd.TEST_GRANT_EVERYONE_EVERYTHING_QUERY_DATA_EXPIRED.expiry_timestamp
+        == sd.TEST_GRANT_EVERYONE_EVERYTHING_QUERY_DATA_EXPIRED.expiry.timestamp()
+    )
+
+    # Derived value must follow field updates made via model_copy(...)
+    unexpired = sd.TEST_GRANT_EVERYONE_EVERYTHING_QUERY_DATA_EXPIRED.model_copy(update={"expiry": None})
+    assert unexpired.expiry_timestamp == math.inf
+
+
 # noinspection PyUnusedLocal
 @pytest.mark.asyncio
 async def test_grant_create(db: Database, db_cleanup):
@@ -50,6 +50,26 @@ async def test_db_group_non_existant(db: Database, db_cleanup):
     assert (await db.get_group(-1)) is None
 
 
+# noinspection PyUnusedLocal
+@pytest.mark.asyncio
+async def test_db_grants_and_groups_snapshot(db: Database, db_cleanup):
+    grants_1, groups_1 = await db.get_grants_and_groups_dict()
+
+    # Nothing has changed, so the same snapshot should be re-used
+    grants_2, groups_2 = await db.get_grants_and_groups_dict()
+    assert grants_2 is grants_1
+    assert groups_2 is groups_1
+
+    # Creating a group bumps the policy version, so the snapshot should be re-fetched and include the new group
+    v = await db.get_policy_version()
+    g_id: int = await db.create_group(TEST_GROUPS[0][0])
+    assert (await db.get_policy_version()) > v
+
+    _, groups_3 = await db.get_grants_and_groups_dict()
+    assert groups_3 is not groups_1
+    assert g_id in groups_3
+
+
 # noinspection PyUnusedLocal
 def test_expired_group_creation_error(auth_headers: dict[str, str], test_client: TestClient, db_cleanup):
     res = test_client.post("/groups/", json=TEST_EXPIRED_GROUP.model_dump(mode="json"), headers=auth_headers)
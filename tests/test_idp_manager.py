@@ -1,11 +1,22 @@
+import jwt
+import orjson
 import pytest
 
 from bento_lib.auth.permissions import P_QUERY_DATA
 from fastapi.testclient import TestClient
+from jwt.utils import base64url_encode
 
 from bento_authorization_service.config import get_config
 from bento_authorization_service.db import Database
-from bento_authorization_service.idp_manager import BaseIdPManager, IdPManagerBadAlgorithmError, get_idp_manager
+from bento_authorization_service.idp_manager import (
+    BaseIdPManager,
+    IdPManager,
+    IdPManagerBadAlgorithmError,
+    UninitializedIdPManagerError,
+    _request_decoded_token,
+    get_idp_manager,
+    get_unverified_header,
+)
 from bento_authorization_service.policy_engine.evaluation import evaluate
 
 from . import shared_data as sd
@@ -20,6 +31,69 @@ def test_base_idp_manager(idp_manager: BaseIdPManager):
     )
 
 
+def _token_with_header(header) -> str:
+    return f"{base64url_encode(orjson.dumps(header)).decode()}.e30.sig"
+
+
+def test_get_unverified_header():
+    token = sd.make_fresh_david_token_encoded()
+    assert get_unverified_header(token) == jwt.get_unverified_header(token)
+
+    assert get_unverified_header(_token_with_header({"alg": "RS256", "kid": "abc"}))["kid"] == "abc"
+
+    with pytest.raises(jwt.DecodeError):
+        get_unverified_header("not a token")
+    with pytest.raises(jwt.DecodeError):
+        get_unverified_header(base64url_encode(orjson.dumps({"alg": "RS256"})).decode())  # Header segment only
+    with pytest.raises(jwt.DecodeError):
+        get_unverified_header(_token_with_header({"alg": "RS256"}) + ".extra")  # Too many segments
+    with pytest.raises(jwt.DecodeError):
+        get_unverified_header(_token_with_header([]))  # Header must be an object
+    with pytest.raises(jwt.DecodeError):
+        get_unverified_header(_token_with_header({"alg": "RS256", "kid": []}))  # Key ID must be a string
+
+
+def test_idp_manager_decoded_token_cache():
+    idp_manager = IdPManager("", sd.TEST_TOKEN_AUD, frozenset(sd.TEST_DISABLED_TOKEN_SIGNING_ALGOS), True)
+
+    token = sd.make_fresh_david_token_encoded()
+    payload = sd.make_fresh_david_token()
+    assert idp_manager._get_cached_decoded_token(token) is None
+    idp_manager._cache_decoded_token(token, payload)
+    assert idp_manager._get_cached_decoded_token(token) == payload
+
+    # Cache entries must never outlive the token itself
+    expired_token = sd.make_fresh_david_token_encoded(exp_offset=-10)
+    idp_manager._cache_decoded_token(expired_token, sd.make_fresh_david_token(exp_offset=-10))
+    assert idp_manager._get_cached_decoded_token(expired_token) is None
+
+
+@pytest.mark.asyncio
+async def test_idp_manager_request_decoded_token():
+    idp_manager_1 = IdPManager("", sd.TEST_TOKEN_AUD, frozenset(sd.TEST_DISABLED_TOKEN_SIGNING_ALGOS), True)
+    idp_manager_2 = IdPManager("", "other-audience", frozenset(sd.TEST_DISABLED_TOKEN_SIGNING_ALGOS), True)
+
+    token = sd.make_fresh_david_token_encoded()
+    payload = sd.make_fresh_david_token()
+    _request_decoded_token.set((idp_manager_1, token, payload, payload["exp"]))
+
+    # Same IdP manager: re-use the payload decoded earlier in this context
+    assert (await idp_manager_1.decode(token)) == payload
+
+    # Different IdP manager (with a different audience): the token must actually be decoded/verified by this manager,
+    # which fails here since it cannot be initialized.
+    with pytest.raises(UninitializedIdPManagerError):
+        await idp_manager_2.decode(token)
+
+    # Expired entry: not re-used
+    _request_decoded_token.set((idp_manager_1, token, payload, payload["exp"] - 3600))
+    with pytest.raises(UninitializedIdPManagerError):
+        await idp_manager_1.decode(token)
+
+    await idp_manager_1.close()
+    await idp_manager_2.close()
+
+
 def test_get_idp_manager():
     assert isinstance(get_idp_manager(get_config()), BaseIdPManager)
 